@@ -0,0 +1,52 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Parallel bulk writer for the uploader.
+Documents are grouped into batches and each batch is written by a pool of worker threads.
+At most `max_pending` batches are queued at any time: once the writers fall behind, pulling the next
+batch from the (lazy) document generator blocks until a write finishes, so memory stays bounded.
+`write_func` takes a list of documents, e.g. `collection.insert_many`, so any backend works
+(a mongo collection, mongomock, or a plain list's `extend` for a dry run).
+"""
+
+
+def iterBatches(docs, batch_size):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if(len(batch) >= batch_size):
+            yield batch
+            batch = []
+    if(len(batch) > 0):
+        yield batch
+
+
+def parallelBulkWrite(docs, write_func, batch_size=1000, num_workers=4, max_pending=None, max_batch_num=None):
+    if(max_pending is None):
+        max_pending = num_workers * 2
+    slots = threading.BoundedSemaphore(max_pending)
+    futures = []
+    total = 0
+
+    def write(batch):
+        try:
+            write_func(batch)
+            return(len(batch))
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        for batch_num, batch in enumerate(iterBatches(docs, batch_size)):
+            if(max_batch_num and batch_num >= max_batch_num):
+                break
+            # backpressure: wait for a free slot before queueing another batch
+            slots.acquire()
+            futures.append(pool.submit(write, batch))
+            # surface write errors as soon as they happen, rather than after reading everything
+            done = [future for future in futures if future.done()]
+            total += sum([future.result() for future in done])
+            futures = [future for future in futures if future not in done]
+        # re-raises the first write error, if any
+        total += sum([future.result() for future in futures])
+    return(total)
@@ -6,7 +6,12 @@ import re
 import collections
 import json
 import os
+import hashlib
+import multiprocessing
+import argparse
+import sys
 from datetime import date, datetime
+from functools import lru_cache
 from outbreak_parser_tools.addendum import Addendum
 
 """
@@ -18,11 +23,20 @@ Sources:
 - PRS data dictionary: https://prsinfo.clinicaltrials.gov/definitions.html
 """
 CT_QUERY = '%22covid-19%22%20OR%20%22sars-cov-2%22'
+# Base URL for the API; can be pointed at a stand-in server (e.g. for testing a sharded harvest locally).
+CT_API = os.environ.get("CT_API", "https://clinicaltrials.gov/api/query")
+# Named searches to harvest; each document is tagged with every query name that matched it.
+# Trials shared between queries are only fetched once.
+CT_QUERIES = {"covid-19": CT_QUERY}
 # Names derived from Natural Earth to standardize to their ISO3 code (ADM0_A3) and NAME for geo-joins: https://www.naturalearthdata.com/downloads/10m-cultural-vectors/
 COUNTRY_FILE = "https://raw.githubusercontent.com/flaneuse/clinical_trials/master/naturalearth_countries.csv"
 COL_NAMES = ["@type", "_id", "identifier", "identifierSource", "url", "name", "alternateName", "abstract", "description", "funding", "author",
              "studyStatus", "studyEvent", "hasResults", "dateCreated", "datePublished", "dateModified", "curatedBy", "healthCondition", "keywords",
-             "studyDesign", "outcome", "eligibilityCriteria", "isBasedOn", "isRelatedTo", "citedBy", "studyLocation", "armGroup", "interventions"]
+             "studyDesign", "outcome", "eligibilityCriteria", "isBasedOn", "isRelatedTo", "citedBy", "studyLocation", "armGroup", "interventions",
+             "matchedQuery", "healthConditionIds", "keywordIds"]
+# NCT ages are free text like "18 Years" or "6 Months"; "N/A" means no limit.
+AGE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(year|month|week|day|hour|minute)s?\s*$", re.IGNORECASE)
+AGE_UNIT_DAYS = {"year": 365.25, "month": 365.25 / 12, "week": 7, "day": 1, "hour": 1 / 24, "minute": 1 / 1440}
 
 
 """
@@ -31,14 +45,10 @@ Lots of revisions of names, coercing to objects/lists, etc.
 """
 
 
-def getUSTrial(api_url, country_dict, col_names):
-    resp = requests.get(api_url)
-    if resp.status_code == 200:
-        raw_data = resp.json()
-        # So the Clinical Trials.gov API *really* likes nested functions
-        studies = raw_data["FullStudiesResponse"]["FullStudies"]
-        flat_studies = [study["Study"] for study in studies]
-        df = pd.DataFrame(flattenJson(flat_studies))
+def getUSTrial(records, country_dict, col_names, summary=None, vocab=None):
+    # `records` can be a generator, so the StudyRecords are only held by the DataFrame
+    df = pd.DataFrame([record.modules for record in records], columns=USED_MODULES)
+    if(len(df) > 0):
 
         # Convert to outbreak.info Clinical Trial schema: https://github.com/SuLab/outbreak.info-resources/blob/master/yaml/outbreak.json
         # Mapping file: https://github.com/flaneuse/clinical-trials/blob/master/schema_mapping.csv
@@ -71,8 +81,10 @@ def getUSTrial(api_url, country_dict, col_names):
         df["curatedBy"] = df.apply(getCurator, axis=1)
         df["author"] = df.apply(getAuthors, axis=1)
         df["healthCondition"] = df["ConditionsModule"].apply(
-            lambda x: x["ConditionList"]["Condition"])
-        df["keywords"] = df["ConditionsModule"].apply(getKeywords)
+            lambda x: internTerms(x["ConditionList"]["Condition"]))
+        df["keywords"] = df["ConditionsModule"].apply(getKeywords).apply(internTerms)
+        df["healthConditionIds"] = df["healthCondition"].apply(getTermIds)
+        df["keywordIds"] = df["keywords"].apply(getTermIds)
         df["studyDesign"] = df["DesignModule"].apply(getDesign)
         df["armGroup"] = df.apply(getArms, axis=1)
         df["interventions"] = df.apply(getInterventions, axis=1)
@@ -86,8 +98,183 @@ def getUSTrial(api_url, country_dict, col_names):
         df["citedBy"] = df.refs.apply(lambda x: x["citedby"])
         df["studyLocation"] = df.apply(lambda x: getLocations(x, country_dict), axis=1)
 
+        # Tally up the release-level counts for the dashboards while everything's in hand
+        if(summary is not None):
+            for row in df[SUMMARY_COLS].to_dict(orient="records"):
+                updateSummary(summary, row)
+        if(vocab is not None):
+            for row in df[VOCAB_COLS].to_dict(orient="records"):
+                updateVocabulary(vocab, row)
+
         return(df)
 
+
+"""
+Fetch one page of full study records from the API.
+"""
+def getStudies(api_url):
+    resp = requests.get(api_url)
+    if resp.status_code == 200:
+        raw_data = resp.json()
+        # So the Clinical Trials.gov API *really* likes nested functions
+        studies = raw_data["FullStudiesResponse"]["FullStudies"]
+        return([study["Study"] for study in studies])
+    return([])
+
+
+"""
+Compact copy of a fetched study, which is what's kept in memory until it's parsed.
+Only the modules the parser reads are kept (so none of the results / MeSH browse sections), and short strings
+that repeat across trials (statuses, countries, cities, sponsor classes...) are interned so each is only stored once.
+"""
+USED_MODULES = ["IdentificationModule", "StatusModule", "SponsorCollaboratorsModule", "DescriptionModule", "ConditionsModule",
+                "DesignModule", "ArmsInterventionsModule", "OutcomesModule", "EligibilityModule", "ContactsLocationsModule",
+                "ReferencesModule", "MiscInfoModule", "LargeDocumentModule"]
+INTERN_MAX_LENGTH = 100
+
+
+def internStrings(obj):
+    if(isinstance(obj, dict)):
+        for key in obj:
+            obj[key] = internStrings(obj[key])
+    elif(isinstance(obj, list)):
+        for i, item in enumerate(obj):
+            obj[i] = internStrings(item)
+    elif(isinstance(obj, str) and (len(obj) <= INTERN_MAX_LENGTH)):
+        return(sys.intern(obj))
+    return(obj)
+
+
+class StudyRecord:
+    __slots__ = ("nct_id", "modules")
+
+    def __init__(self, study):
+        self.modules = {}
+        for section in study.values():
+            for name in USED_MODULES:
+                if(name in section):
+                    self.modules[name] = internStrings(section[name])
+        self.nct_id = self.modules["IdentificationModule"]["NCTId"]
+
+"""
+Release-level summary counts (trials by status, phase, country, etc.) so the front end doesn't have to
+aggregate over the whole index. Each trial counts once per value, e.g. once per country it has a site in.
+Summaries are plain Counters so per-batch or per-shard summaries can be added together.
+"""
+SUMMARY_COLS = ["studyStatus", "studyDesign", "studyLocation", "interventions", "funding", "dateCreated"]
+SUMMARY_FACETS = ["status", "phaseNumber", "country", "interventionCategory", "funderClass", "dateCreated"]
+
+
+def newSummary():
+    return({facet: collections.Counter() for facet in SUMMARY_FACETS})
+
+
+def getListValues(arr, key):
+    if(isinstance(arr, list)):
+        return(set([item[key] for item in arr if isinstance(item, dict) and (item.get(key) is not None)]))
+    return(set())
+
+
+def updateSummary(summary, row):
+    if(isinstance(row["studyStatus"], dict)):
+        summary["status"][row["studyStatus"]["status"]] += 1
+    if(isinstance(row["studyDesign"], dict)):
+        phases = set([phase for phase in row["studyDesign"].get("phaseNumber", []) if phase is not None])
+        summary["phaseNumber"].update([str(phase) for phase in phases])
+    summary["country"].update(getListValues(row["studyLocation"], "studyLocationCountry"))
+    summary["interventionCategory"].update(getListValues(row["interventions"], "category"))
+    if(isinstance(row["funding"], list)):
+        summary["funderClass"].update(set(flatten([getListValues(fund["funder"], "class") for fund in row["funding"]])))
+    summary["dateCreated"][row["dateCreated"]] += 1
+    return(summary)
+
+
+def mergeSummaries(summaries):
+    merged = newSummary()
+    for summary in summaries:
+        for facet in SUMMARY_FACETS:
+            merged[facet].update(summary[facet])
+    return(merged)
+
+
+def formatSummary(summary):
+    obj = {"_id": "clinical_trials_summary", "@type": "ClinicalTrialSummary",
+           "total": sum(summary["dateCreated"].values()), "dateGenerated": date.today().strftime("%Y-%m-%d")}
+    for facet in SUMMARY_FACETS[:-1]:
+        obj[facet] = dict(summary[facet].most_common())
+    # time series of new + cumulative trials by date created
+    series = []
+    cumulative = 0
+    for date_created in sorted(summary["dateCreated"].keys()):
+        cumulative += summary["dateCreated"][date_created]
+        series.append({"date": date_created, "count": summary["dateCreated"][date_created], "cumulative": cumulative})
+    obj["dateCreated"] = series
+    return(obj)
+
+"""
+Condition/keyword vocabulary. Terms are normalized (case + whitespace) and given an ID from a hash of the
+normalized term, so IDs are the same across batches, shards and releases (and can be computed by a client).
+The vocabulary maps ID: term, and the inverted index maps ID: [NCTIds] for "all trials for condition X" lookups.
+"""
+TERM_SPACE_PATTERN = re.compile(r"\s+")
+VOCAB_COLS = ["_id", "healthCondition", "healthConditionIds", "keywords", "keywordIds"]
+VOCAB_FACETS = [("conditions", "healthCondition", "healthConditionIds"), ("keywords", "keywords", "keywordIds")]
+
+
+def normalizeTerm(term):
+    return(sys.intern(TERM_SPACE_PATTERN.sub(" ", term).strip().lower()))
+
+
+@lru_cache(maxsize=None)
+def getTermId(term):
+    return(sys.intern(hashlib.md5(normalizeTerm(term).encode("utf-8")).hexdigest()[:12]))
+
+
+def internTerms(terms):
+    if(isinstance(terms, list)):
+        return([sys.intern(term) for term in terms])
+    return(terms)
+
+
+def getTermIds(terms):
+    if(isinstance(terms, list)):
+        # dict to drop repeats while keeping the order
+        return(list(dict.fromkeys([getTermId(term) for term in terms if normalizeTerm(term) != ""])))
+    return([])
+
+
+def newVocabulary():
+    return({facet: {"terms": {}, "index": collections.defaultdict(list)} for facet, _, _ in VOCAB_FACETS})
+
+
+def updateVocabulary(vocab, row):
+    for facet, term_col, id_col in VOCAB_FACETS:
+        if(isinstance(row[term_col], list)):
+            for term in row[term_col]:
+                if(normalizeTerm(term) != ""):
+                    vocab[facet]["terms"][getTermId(term)] = normalizeTerm(term)
+        for id in row[id_col]:
+            vocab[facet]["index"][id].append(row["_id"])
+    return(vocab)
+
+
+def mergeVocabularies(vocabs):
+    merged = newVocabulary()
+    for vocab in vocabs:
+        for facet, _, _ in VOCAB_FACETS:
+            merged[facet]["terms"].update(vocab[facet]["terms"])
+            for id, nct_ids in vocab[facet]["index"].items():
+                merged[facet]["index"][id].extend(nct_ids)
+    return(merged)
+
+
+def formatVocabulary(vocab):
+    obj = {"_id": "clinical_trials_vocabulary", "@type": "ClinicalTrialVocabulary"}
+    for facet, _, _ in VOCAB_FACETS:
+        obj[facet] = {"terms": vocab[facet]["terms"],
+                      "index": {id: sorted(set(nct_ids)) for id, nct_ids in vocab[facet]["index"].items()}}
+    return(obj)
+
 # Generic helper functions
 def formatDate(x, inputFormat="%B %d, %Y", outputFormat="%Y-%m-%d"):
     date_str = datetime.strptime(x, inputFormat).strftime(outputFormat)
@@ -118,18 +305,6 @@ def flatten(l):
         else:
             yield el
 
-def flattenJson(arr):
-    flat_list = []
-
-    for study in arr:
-        obj = {}
-        for key in study:
-            for innerKey in study[key]:
-                obj[innerKey] = study[key][innerKey]
-        flat_list.append(obj)
-    return(flat_list)
-
-
 def listify(row, col_names):
     arr = []
     for col in col_names:
@@ -185,6 +360,33 @@ def parseCriteria(criteriaString):
 def removeInclHeader(x):
     return((x.lower() != "inclusion criteria:") & (x.lower() != "inclusion criteria") & (x.lower() != "exclusion criteria:") & (x.lower() != "exclusion criteria") & (x.lower() != "non-inclusion criteria:") & (x.lower() != "non-inclusion criteria"))
 
+# Convert an NCT age string to a number of days; None if it can't be parsed (e.g. "N/A").
+# Memoized since there are only a handful of distinct age strings across all the trials.
+@lru_cache(maxsize=None)
+def parseAge(age):
+    match = AGE_PATTERN.match(age)
+    if match is None:
+        return(None)
+    return(float(match.group(1)) * AGE_UNIT_DAYS[match.group(2).lower()])
+
+
+def getAgeRange(obj, row):
+    min_days = parseAge(row["MinimumAge"]) if "MinimumAge" in row.keys() else None
+    max_days = parseAge(row["MaximumAge"]) if "MaximumAge" in row.keys() else None
+    age_range = {}
+    if(min_days is not None):
+        obj["minimumAgeDays"] = round(min_days)
+        obj["minimumAgeYears"] = round(min_days / AGE_UNIT_DAYS["year"], 2)
+        age_range["gte"] = obj["minimumAgeYears"]
+    if(max_days is not None):
+        obj["maximumAgeDays"] = round(max_days)
+        obj["maximumAgeYears"] = round(max_days / AGE_UNIT_DAYS["year"], 2)
+        age_range["lte"] = obj["maximumAgeYears"]
+    if(age_range):
+        obj["ageRange"] = age_range
+    return(obj)
+
+
 def getEligibility(row):
     obj = {}
     obj["@type"] = "Eligibility"
@@ -193,6 +395,8 @@ def getEligibility(row):
         obj["minimumAge"] = row["MinimumAge"].lower()
     if("MaximumAge" in row.keys()):
         obj["maximumAge"] = row["MaximumAge"].lower()
+    # numeric versions of the ages, so range queries don't have to re-parse the strings
+    obj = getAgeRange(obj, row)
     if("Gender" in row.keys()):
         obj["gender"] = row["Gender"].lower()
     if("HealthyVolunteers" in row.keys()):
@@ -606,7 +810,7 @@ Also, the NCT API doesn't seem to have explicit pagination, which means that the
 To try to mitigate this behavior, doing calls along a window to try to grab all the IDs.
 """
 def getIDSingle(query, minIdx):
-    id_query = f"https://clinicaltrials.gov/api/query/study_fields?expr={query}&min_rnk={int(minIdx*1000+1)}&max_rnk={int(minIdx*1000+1000)}&fields=NCTId&fmt=json"
+    id_query = f"{CT_API}/study_fields?expr={query}&min_rnk={int(minIdx*1000+1)}&max_rnk={int(minIdx*1000+1000)}&fields=NCTId&fmt=json"
     resp = requests.get(id_query)
     if resp.status_code == 200:
         raw_data = resp.json()
@@ -636,56 +840,258 @@ def getIDs(query):
     return({"ids": unique_ids, "total": num_results})
 
 """
-Main function to execute the API calls, since they're limited to 100 full records at a time
+Helper function to get the IDs for each of the named queries, and which queries matched each ID.
 """
-def getUSTrials(query, country_file, col_names, json_output=True):
-    num_per_query = 100
+def getQueryMatches(queries):
+    matches = {}
+    totals = {}
+    combos = {}
+    for name, query in queries.items():
+        print(f"Getting IDs for query '{name}'")
+        id_dict = getIDs(query)
+        totals[name] = id_dict["total"]
+        for id in id_dict["ids"]:
+            # IDs matching the same queries share one list, rather than a copy each
+            key = tuple(matches.get(id, [])) + (name,)
+            matches[id] = combos.setdefault(key, list(key))
+    return({"matches": matches, "totals": totals})
 
-    # Natural Earth file to normalize country names.
-    ctry_dict = pd.read_csv(country_file).set_index("name").to_dict(orient="index")
-    # Run one query to get the IDs of all the studies.
-    # Can't loop through numbers of studies à la pagination, since the API returns things in an inconsistent order
-    id_dict = getIDs(query)
-    num_results = id_dict["total"]
-    ids = id_dict["ids"]
-    results = pd.DataFrame()
+"""
+Helper function to fetch the full records for a list of IDs, since they're limited to 100 full records at a time.
+Records are stored in `study_cache` as StudyRecords by NCT ID; anything already in the cache isn't requested again,
+so trials shared by several queries (or across calls sharing the same cache) are only fetched once.
+Returns the IDs of every record the API sent back, to check for duplicates and extra records.
+"""
+def fetchStudies(ids, study_cache, num_per_query=100):
+    missing = [id for id in ids if id not in study_cache]
+    num_calls = ceil(len(missing) / num_per_query)
+    returned = []
     i = 0
-    while i < ceil(num_results / num_per_query):
-        print(f"Executing query {i+1} of {ceil(num_results / num_per_query)}")
-        query_ids = " OR ".join(ids[i * num_per_query:(i + 1) * num_per_query])
-        url = f"https://clinicaltrials.gov/api/query/full_studies?expr=({query_ids})&min_rnk=1&max_rnk=100&fmt=json"
-        df = getUSTrial(url, ctry_dict, col_names)
-        results = pd.concat([results, df], ignore_index=True, sort=False)
+    while i < num_calls:
+        print(f"Executing query {i+1} of {num_calls}")
+        query_ids = " OR ".join(missing[i * num_per_query:(i + 1) * num_per_query])
+        url = f"{CT_API}/full_studies?expr=({query_ids})&min_rnk=1&max_rnk={num_per_query}&fmt=json"
+        # the rest of the raw response is dropped as soon as its records are pulled out
+        for study in getStudies(url):
+            record = StudyRecord(study)
+            study_cache[record.nct_id] = record
+            returned.append(record.nct_id)
         i += 1
-    # Double check that the numbers all agree
-    filtered = results[results._id.isin(ids)]
+    return(returned)
 
-    if(len(filtered) != num_results):
-        print(
-            f"\nWARNING: number of IDs queried don't equal the number of results. {num_results} expected, but {len(filtered)} records found.\n")
-    if(len(results) != len(filtered)):
-        extra = results[~results._id.isin(ids)]
+"""
+Double check that the numbers all agree: every query's total vs. the records found, records the API returned
+that weren't asked for, and records returned more than once.
+`matches` is NCT ID: [query names], `found` the IDs with a record, `returned` every ID the API sent back.
+"""
+def checkHarvest(matches, totals, found, returned):
+    for name, total in totals.items():
+        num_found = sum([name in matches[id] for id in found])
+        if(num_found != total):
+            print(
+                f"\nWARNING: number of IDs queried don't equal the number of results for query '{name}'. {total} expected, but {num_found} records found.\n")
+    extra = sorted(set(returned) - set(matches.keys()))
+    if(len(extra) > 0):
         print(f"\nWARNING: ids removed because they weren't in the initial query to get the ID list. Presumably, this record contains a COVID id somewhere in one of its other fields but is not a COVID-19 clinical trial.")
-        print(extra._id)
-    if(sum(filtered.duplicated(subset="_id"))):
-        dupes = filtered[filtered.duplicated(subset="_id")]
+        print(extra)
+    dupes = [id for id, count in collections.Counter(returned).items() if (count > 1) & (id in matches)]
+    if(len(dupes) > 0):
         print(
-            f"\nERROR: {sum(filtered.duplicated(subset='_id'))} duplicate IDs found:")
-        print(dupes._id)
+            f"\nERROR: {len(dupes)} duplicate IDs found:")
+        print(dupes)
+
+
+"""
+Convert the fetched studies to outbreak.info docs, tagged with the queries that matched them.
+"""
+def buildDocs(studies, matches, country_dict, col_names, json_output=True, summary=None, vocab=None):
+    filtered = getUSTrial(studies, country_dict, col_names, summary, vocab)
+    if(filtered is None):
+        return([] if json_output else pd.DataFrame(columns=col_names))
+    filtered["matchedQuery"] = filtered["_id"].map(matches)
 
     if(json_output):
         protocols = flattenList(filtered.loc[(filtered.protocols.notnull()), "protocols"])
         output = filtered[col_names].to_dict(orient="records")
-        output = output + protocols
+        # done with the frame (and the raw modules it holds) before adding on the protocols
+        del filtered
+        output.extend(protocols)
     else:
         output = filtered
     return(output)
 
-# df = getUSTrials(CT_QUERY, COUNTRY_FILE, COL_NAMES, False)
+
+"""
+Main function to execute the API calls.
+`queries` is a dict of query name: query expression (a single query string is also accepted).
+"""
+def getUSTrials(queries, country_file, col_names, json_output=True, study_cache=None, summary_file=None, vocab_file=None):
+    if(isinstance(queries, str)):
+        queries = {"query": queries}
+    own_cache = study_cache is None
+    if(own_cache):
+        study_cache = {}
+
+    # Natural Earth file to normalize country names.
+    ctry_dict = pd.read_csv(country_file).set_index("name").to_dict(orient="index")
+    # Run one query per topic to get the IDs of all the studies.
+    # Can't loop through numbers of studies à la pagination, since the API returns things in an inconsistent order
+    query_dict = getQueryMatches(queries)
+    matches = query_dict["matches"]
+    ids = sorted(matches.keys())
+    returned = fetchStudies(ids, study_cache)
+
+    found = [id for id in ids if id in study_cache]
+    checkHarvest(matches, query_dict["totals"], found, returned)
+    summary = newSummary()
+    vocab = newVocabulary()
+    # a cache that's only ours is emptied as it's parsed, so the raw records don't outlive the DataFrame
+    if(own_cache):
+        records = (study_cache.pop(id) for id in found)
+    else:
+        records = (study_cache[id] for id in found)
+    output = buildDocs(records, matches, ctry_dict, col_names, json_output, summary, vocab)
+    if(summary_file is not None):
+        writeJson(formatSummary(summary), summary_file)
+    if(vocab_file is not None):
+        writeJson(formatVocabulary(vocab), vocab_file)
+    return(output)
+
+
+"""
+Sharded harvest, to split the fetch + transform over several workers/nodes:
+1. `planHarvest` enumerates the IDs once and writes them to `output_dir`
+2. `harvestShard` (one per worker, all sharing `output_dir`) fetches + transforms the IDs in its shard,
+   and writes the docs and a small manifest of the IDs it asked for / got back
+3. `mergeShards` runs the same checks as getUSTrials from the manifests, and combines the docs, summaries and vocabularies.
+Shards are assigned by a hash of the NCT ID, so a trial always lands in the same shard for a given number of shards.
+`harvestSharded` runs all three locally, with one process per shard.
+"""
+SHARD_PLAN_FILE = "plan.json"
+
+
+def getShard(nct_id, num_shards):
+    return(int(hashlib.md5(nct_id.encode("utf-8")).hexdigest(), 16) % num_shards)
+
+
+def getShardFiles(output_dir, shard):
+    return({"docs": os.path.join(output_dir, f"shard_{shard}.json"),
+            "manifest": os.path.join(output_dir, f"shard_{shard}_manifest.json"),
+            "vocab": os.path.join(output_dir, f"shard_{shard}_vocab.json")})
+
+
+def writeJson(obj, filename):
+    # numpy scalars sneak in from the DataFrame
+    with open(filename, "w") as f:
+        json.dump(obj, f, default=lambda x: x.item() if isinstance(x, np.generic) else str(x))
+
+
+def readJson(filename):
+    with open(filename) as f:
+        return(json.load(f))
+
+
+def planHarvest(queries, output_dir, num_shards):
+    if(isinstance(queries, str)):
+        queries = {"query": queries}
+    query_dict = getQueryMatches(queries)
+    plan = {"num_shards": num_shards, "matches": query_dict["matches"], "totals": query_dict["totals"]}
+    os.makedirs(output_dir, exist_ok=True)
+    writeJson(plan, os.path.join(output_dir, SHARD_PLAN_FILE))
+    return(plan)
+
+
+def harvestShard(output_dir, shard, country_file, col_names):
+    plan = readJson(os.path.join(output_dir, SHARD_PLAN_FILE))
+    if(shard not in range(plan["num_shards"])):
+        raise ValueError(f"shard must be between 0 and {plan['num_shards'] - 1}, got {shard}")
+    matches = plan["matches"]
+    ids = [id for id in sorted(matches.keys()) if getShard(id, plan["num_shards"]) == shard]
+    print(f"Shard {shard}: {len(ids)} IDs")
+
+    ctry_dict = pd.read_csv(country_file).set_index("name").to_dict(orient="index")
+    study_cache = {}
+    returned = fetchStudies(ids, study_cache)
+    found = [id for id in ids if id in study_cache]
+    summary = newSummary()
+    vocab = newVocabulary()
+    docs = buildDocs((study_cache.pop(id) for id in found), matches, ctry_dict, col_names, True, summary, vocab)
+
+    files = getShardFiles(output_dir, shard)
+    writeJson(docs, files["docs"])
+    writeJson(vocab, files["vocab"])
+    writeJson({"shard": shard, "ids": ids, "found": found, "returned": returned, "num_docs": len(docs),
+               "summary": summary}, files["manifest"])
+    return(files)
+
+
+def mergeShards(output_dir, summary_file=None, vocab_file=None):
+    plan = readJson(os.path.join(output_dir, SHARD_PLAN_FILE))
+    found = []
+    returned = []
+    manifests = []
+    for shard in range(plan["num_shards"]):
+        manifest = readJson(getShardFiles(output_dir, shard)["manifest"])
+        found.extend(manifest["found"])
+        returned.extend(manifest["returned"])
+        manifests.append(manifest)
+    checkHarvest(plan["matches"], plan["totals"], found, returned)
+    if(summary_file is not None):
+        writeJson(formatSummary(mergeSummaries([manifest["summary"] for manifest in manifests])), summary_file)
+    if(vocab_file is not None):
+        vocabs = [readJson(getShardFiles(output_dir, shard)["vocab"]) for shard in range(plan["num_shards"])]
+        writeJson(formatVocabulary(mergeVocabularies(vocabs)), vocab_file)
+
+    docs = []
+    for manifest in manifests:
+        shard_docs = readJson(getShardFiles(output_dir, manifest["shard"])["docs"])
+        if(len(shard_docs) != manifest["num_docs"]):
+            print(f"\nERROR: shard {manifest['shard']} should have {manifest['num_docs']} docs, but {len(shard_docs)} found.")
+        docs.extend(shard_docs)
+    return(docs)
+
+
+def harvestSharded(queries, country_file, col_names, output_dir, num_shards=4, summary_file=None, vocab_file=None):
+    planHarvest(queries, output_dir, num_shards)
+    with multiprocessing.Pool(num_shards) as pool:
+        pool.starmap(harvestShard, [(output_dir, shard, country_file, col_names) for shard in range(num_shards)])
+    return(mergeShards(output_dir, summary_file, vocab_file))
+
+# df = getUSTrials(CT_QUERIES, COUNTRY_FILE, COL_NAMES, False)
 # df.iloc[0]["armGroup"]
 
-def load_annotations():
-    docs = getUSTrials(CT_QUERY, COUNTRY_FILE, COL_NAMES, True)
+def load_annotations(shard_dir=None, summary_file=None, vocab_file=None):
+    # Docs already harvested by sharded workers just need merging
+    if(shard_dir is not None):
+        docs = mergeShards(shard_dir, summary_file, vocab_file)
+    else:
+        docs = getUSTrials(CT_QUERIES, COUNTRY_FILE, COL_NAMES, True, summary_file=summary_file, vocab_file=vocab_file)
     Addendum.topic_adder().update(docs)
     for doc in docs:
         yield doc
+
+
+# Entry point for running a sharded harvest across several workers/nodes, e.g.
+# python parser.py plan --output-dir out --num-shards 4
+# python parser.py shard --output-dir out --shard 0   (one per worker)
+# python parser.py merge --output-dir out
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Sharded harvest of clinicaltrials.gov")
+    arg_parser.add_argument("step", choices=["plan", "shard", "merge", "all"])
+    arg_parser.add_argument("--output-dir", required=True)
+    arg_parser.add_argument("--num-shards", type=int, default=4)
+    arg_parser.add_argument("--shard", type=int)
+    arg_parser.add_argument("--summary-file")
+    arg_parser.add_argument("--vocab-file")
+    args = arg_parser.parse_args()
+    if((args.step == "shard") & (args.shard is None)):
+        arg_parser.error("--shard is required for the shard step")
+
+    if(args.step == "plan"):
+        planHarvest(CT_QUERIES, args.output_dir, args.num_shards)
+    elif(args.step == "shard"):
+        harvestShard(args.output_dir, args.shard, COUNTRY_FILE, COL_NAMES)
+    elif(args.step == "merge"):
+        print(f"{len(mergeShards(args.output_dir, args.summary_file, args.vocab_file))} docs merged")
+    else:
+        print(f"{len(harvestSharded(CT_QUERIES, COUNTRY_FILE, COL_NAMES, args.output_dir, args.num_shards, args.summary_file, args.vocab_file))} docs merged")
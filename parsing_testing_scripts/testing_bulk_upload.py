@@ -0,0 +1,69 @@
+# Checks for the parallel bulk writer (bulk_upload.py) against an in-memory backend, and mongomock if it's installed:
+# every doc is written exactly once, a failing writer re-raises its error, and more workers means less time
+# when each write is slow.
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bulk_upload import parallelBulkWrite
+
+NUM_DOCS = 1000
+BATCH_SIZE = 50
+WRITE_LATENCY = 0.05
+
+
+def makeDocs():
+    return(({"_id": f"NCT{i:08d}"} for i in range(NUM_DOCS)))
+
+
+def timedWrite(num_workers):
+    written = []
+    lock = threading.Lock()
+
+    def write(batch):
+        time.sleep(WRITE_LATENCY)
+        with lock:
+            written.extend(batch)
+
+    start = time.time()
+    total = parallelBulkWrite(makeDocs(), write, batch_size=BATCH_SIZE, num_workers=num_workers)
+    elapsed = time.time() - start
+    assert total == NUM_DOCS, f"{total} docs reported, {NUM_DOCS} expected"
+    assert sorted([doc["_id"] for doc in written]) == sorted([doc["_id"] for doc in makeDocs()]), "docs missing or written twice"
+    return(elapsed)
+
+
+# counts + scaling with the number of workers
+serial = timedWrite(1)
+parallel = timedWrite(4)
+print(f"{NUM_DOCS} docs: {serial:.2f}s with 1 worker, {parallel:.2f}s with 4 workers")
+assert parallel < serial / 2, "4 workers should be well over twice as fast as 1"
+
+
+# errors in a writer are raised to the caller
+def failingWrite(batch):
+    raise ValueError("write failed")
+
+try:
+    parallelBulkWrite(makeDocs(), failingWrite, batch_size=BATCH_SIZE, num_workers=4)
+    raise AssertionError("failing writer didn't raise")
+except ValueError as err:
+    print(f"failing writer raised: {err}")
+
+
+# same thing against a mongo stand-in, like ParallelBulkStorage does
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+if(mongomock is not None):
+    collection = mongomock.MongoClient().db.clinicaltrials
+    total = parallelBulkWrite(makeDocs(), lambda batch: collection.insert_many(batch, ordered=False),
+                              batch_size=BATCH_SIZE, num_workers=4)
+    assert total == collection.count_documents({}) == NUM_DOCS
+    print(f"mongomock: {total} docs written")
+else:
+    print("mongomock not installed; skipping")
@@ -0,0 +1,83 @@
+# Peak-memory check for a large harvest, so the parser still fits on small hub workers.
+# Builds a 10k-study fixture from the example record (NCT04341441, same as the README), with the free text varied per
+# study (titles, descriptions, criteria, outcomes, people, facilities, conditions, keywords) so it doesn't intern away,
+# and the enumerated values (cities, countries, sponsors, statuses) drawn from pools, like a real harvest.
+# Runs it through the same path as getUSTrials (StudyRecords -> buildDocs), and fails if the peak goes over budget.
+# On this fixture the parser peaked at ~1.1 GB before StudyRecords, and ~760 MB after.
+import json
+import os
+import sys
+import tracemalloc
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from parser import StudyRecord, buildDocs, newSummary, newVocabulary, COL_NAMES
+
+NUM_STUDIES = 10000
+PEAK_BUDGET_MB = 850
+FIXTURE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "NCT04341441.json")
+COUNTRY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "naturalearth_countries.csv")
+
+CITIES = [("Detroit", "Michigan", "United States"), ("Boston", "Massachusetts", "United States"), ("Paris", None, "France"),
+          ("Madrid", None, "Spain"), ("São Paulo", "São Paulo", "Brazil"), ("Wuhan", "Hubei", "China"),
+          ("Toronto", "Ontario", "Canada"), ("Milan", None, "Italy"), ("Cairo", None, "Egypt"), ("Mumbai", "Maharashtra", "India")]
+STATUSES = ["Recruiting", "Not yet recruiting", "Active, not recruiting", "Completed", "Withdrawn"]
+
+with open(FIXTURE_FILE) as f:
+    raw = f.read()
+
+
+def varyStudy(study, i):
+    protocol = study["ProtocolSection"]
+    ident = protocol["IdentificationModule"]
+    ident["NCTId"] = f"NCT{i:08d}"
+    ident["BriefTitle"] = f"{ident['BriefTitle']} (cohort {i})"
+    ident["OfficialTitle"] = f"{ident['OfficialTitle']}, protocol {i}"
+    ident["Acronym"] = f"TRIAL-{i}"
+    protocol["StatusModule"]["OverallStatus"] = STATUSES[i % len(STATUSES)]
+    desc = protocol["DescriptionModule"]
+    desc["BriefSummary"] = f"Study {i}. {desc['BriefSummary']}"
+    desc["DetailedDescription"] = f"Study {i}. {desc['DetailedDescription']}"
+    protocol["EligibilityModule"]["EligibilityCriteria"] += f"\nParticipant meets the site {i} screening criteria."
+    for outcome in protocol["OutcomesModule"]["PrimaryOutcomeList"]["PrimaryOutcome"]:
+        outcome["PrimaryOutcomeMeasure"] = f"{outcome['PrimaryOutcomeMeasure']} (study {i})"
+    sponsor = protocol["SponsorCollaboratorsModule"]
+    sponsor["LeadSponsor"]["LeadSponsorName"] = f"Sponsor {i % 800}"
+    sponsor["ResponsibleParty"]["ResponsiblePartyInvestigatorFullName"] = f"Investigator {i}"
+    contacts = protocol["ContactsLocationsModule"]
+    for contact in contacts["CentralContactList"]["CentralContact"]:
+        contact["CentralContactName"] = f"Contact {i}"
+    for official in contacts["OverallOfficialList"]["OverallOfficial"]:
+        official["OverallOfficialName"] = f"Official {i}"
+    for j, location in enumerate(contacts["LocationList"]["Location"]):
+        city, state, country = CITIES[(i + j) % len(CITIES)]
+        location["LocationFacility"] = f"Hospital {(i + j) % 3000}"
+        location["LocationCity"] = city
+        location["LocationCountry"] = country
+        if(state is None):
+            location.pop("LocationState", None)
+        else:
+            location["LocationState"] = state
+    conditions = protocol["ConditionsModule"]
+    conditions["ConditionList"]["Condition"].append(f"Condition {i % 500}")
+    conditions["KeywordList"]["Keyword"].extend([f"Keyword {i % 1000}", f"Marker {i}"])
+    return(study)
+ctry_dict = pd.read_csv(COUNTRY_FILE).set_index("name").to_dict(orient="index")
+
+tracemalloc.start()
+study_cache = {}
+for i in range(NUM_STUDIES):
+    # parse each copy separately, like separate API responses
+    study = varyStudy(json.loads(raw), i)
+    record = StudyRecord(study)
+    study_cache[record.nct_id] = record
+del study
+
+ids = sorted(study_cache.keys())
+matches = {id: ["covid-19"] for id in ids}
+docs = buildDocs((study_cache.pop(id) for id in ids), matches, ctry_dict, COL_NAMES, True, newSummary(), newVocabulary())
+current, peak = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+
+print(f"{len(docs)} docs; peak {peak / 1e6:.0f} MB, after parsing {current / 1e6:.0f} MB (budget {PEAK_BUDGET_MB} MB)")
+assert peak / 1e6 <= PEAK_BUDGET_MB, f"peak memory {peak / 1e6:.0f} MB is over the {PEAK_BUDGET_MB} MB budget"
@@ -0,0 +1,98 @@
+# Checks the sharded harvest against a single-process one, using several local processes and a stand-in API.
+# The stand-in serves the two endpoints the parser uses (study_fields for the IDs, full_studies for the records)
+# from copies of the example record (NCT04341441, same as the README), with a few fields varied per trial.
+import copy
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+NUM_STUDIES = 2500
+NUM_SHARDS = 3
+PORT = 8765
+
+# has to be set before the parser is imported (and is inherited by the shard processes)
+os.environ["CT_API"] = f"http://127.0.0.1:{PORT}"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import parser
+
+FIXTURE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "NCT04341441.json")
+COUNTRY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "naturalearth_countries.csv")
+
+
+def makeStudies():
+    with open(FIXTURE_FILE) as f:
+        example = json.load(f)
+    studies = {}
+    for i in range(NUM_STUDIES):
+        study = copy.deepcopy(example)
+        nct_id = f"NCT{i:08d}"
+        study["ProtocolSection"]["IdentificationModule"]["NCTId"] = nct_id
+        if(i % 3 == 0):
+            study["ProtocolSection"]["StatusModule"]["OverallStatus"] = "Completed"
+        study["ProtocolSection"]["ConditionsModule"]["ConditionList"]["Condition"].append(f"Condition {i % 50}")
+        studies[nct_id] = study
+    return(studies)
+
+
+def startStandIn(studies):
+    ids = sorted(studies.keys())
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if(url.path.endswith("study_fields")):
+                page = ids[int(query["min_rnk"][0]) - 1:int(query["max_rnk"][0])]
+                body = {"StudyFieldsResponse": {"NStudiesFound": len(ids), "NStudiesReturned": len(page),
+                                                "StudyFields": [{"NCTId": [id]} for id in page]}}
+            else:
+                wanted = re.findall(r"NCT\d+", query["expr"][0])
+                body = {"FullStudiesResponse": {"FullStudies": [{"Study": studies[id]} for id in wanted if id in studies]}}
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", PORT), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return(server)
+
+
+if __name__ == "__main__":
+    server = startStandIn(makeStudies())
+    with tempfile.TemporaryDirectory() as output_dir:
+        sharded_summary = os.path.join(output_dir, "summary_sharded.json")
+        single_summary = os.path.join(output_dir, "summary_single.json")
+        sharded_vocab = os.path.join(output_dir, "vocab_sharded.json")
+        single_vocab = os.path.join(output_dir, "vocab_single.json")
+
+        sharded = parser.harvestSharded(parser.CT_QUERIES, COUNTRY_FILE, parser.COL_NAMES, os.path.join(output_dir, "shards"),
+                                        NUM_SHARDS, sharded_summary, sharded_vocab)
+        single = parser.getUSTrials(parser.CT_QUERIES, COUNTRY_FILE, parser.COL_NAMES, True,
+                                    summary_file=single_summary, vocab_file=single_vocab)
+
+        # same docs, regardless of which shard they came from (and round-tripped through JSON like the shards are)
+        single = json.loads(json.dumps(single, default=lambda x: x.item()))
+        sort_key = lambda doc: doc["_id"]
+        assert len(sharded) == len(single), f"{len(sharded)} sharded docs vs {len(single)} single-process docs"
+        assert sorted(sharded, key=sort_key) == sorted(single, key=sort_key), "sharded docs differ from the single-process ones"
+        assert parser.readJson(sharded_summary) == parser.readJson(single_summary), "summaries differ"
+        assert parser.readJson(sharded_vocab) == parser.readJson(single_vocab), "vocabularies differ"
+
+        # shards outside the plan are an error, not an empty shard
+        try:
+            parser.harvestShard(os.path.join(output_dir, "shards"), NUM_SHARDS, COUNTRY_FILE, parser.COL_NAMES)
+            raise AssertionError("out-of-range shard didn't raise")
+        except ValueError as err:
+            print(f"out-of-range shard raised: {err}")
+    server.shutdown()
+    print(f"{len(sharded)} docs from {NUM_SHARDS} shards match the single-process harvest")
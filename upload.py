@@ -1,5 +1,7 @@
 import biothings.hub.dataload.uploader
+from biothings.hub.dataload.storage import BasicStorage
 import os
+import json
 
 import biothings
 import config
@@ -9,11 +11,68 @@ biothings.config_for_app(config)
 MAP_URL = "https://raw.githubusercontent.com/SuLab/outbreak.info-resources/master/outbreak_resources_es_mapping_v3.json"
 MAP_VARS = ["@type", "abstract", "alternateName", "armGroup", "author", "citedBy", "curatedBy", "date", "dateCreated", "dateModified", "datePublished", "description", "eligibilityCriteria", "hasResults", "healthCondition", "identifier", "identifierSource", "interventions", "isBasedOn", "keywords", "name", "outcome", "protocolSetting", "protocolCategory", "isRelatedTo", "funding", "studyDesign", "studyEvent", "studyLocation", "studyStatus", "url", "topicCategory"]
 
+# Mappings for fields this parser adds that aren't in the shared outbreak.info mapping; merged into it in get_mapping
+LOCAL_MAPPING = {
+    "eligibilityCriteria": {
+        "properties": {
+            "minimumAgeDays": {"type": "integer"},
+            "maximumAgeDays": {"type": "integer"},
+            "minimumAgeYears": {"type": "float"},
+            "maximumAgeYears": {"type": "float"},
+            "ageRange": {"type": "float_range"}
+        }
+    },
+    "matchedQuery": {"type": "keyword"},
+    "healthConditionIds": {"type": "keyword"},
+    "keywordIds": {"type": "keyword"}
+}
+
+# Parallel bulk upload settings; override in the hub's config. Off by default (one batch at a time, with BasicStorage)
+PARALLEL_UPLOAD = getattr(config, "CLINICAL_TRIALS_PARALLEL_UPLOAD", False)
+UPLOAD_BATCH_SIZE = getattr(config, "CLINICAL_TRIALS_UPLOAD_BATCH_SIZE", None)
+UPLOAD_WORKERS = getattr(config, "CLINICAL_TRIALS_UPLOAD_WORKERS", 4)
+# Release-level counts for the front end, written alongside the release and published to its own collection
+SUMMARY_FILE = "summary.json"
+SUMMARY_COLLECTION = "clinicaltrials_summary"
+# Normalized condition/keyword vocabulary + inverted index to NCTIds, published as one doc per term
+VOCAB_FILE = "vocabulary.json"
+VOCAB_COLLECTION = "clinicaltrials_vocabulary"
+
 # when code is exported, import becomes relative
 try:
     from clinical_trials.parser import load_annotations as parser_func
+    from clinical_trials.parser import SHARD_PLAN_FILE
+    from clinical_trials.bulk_upload import parallelBulkWrite
 except ImportError:
     from .parser import load_annotations as parser_func
+    from .parser import SHARD_PLAN_FILE
+    from .bulk_upload import parallelBulkWrite
+
+
+class ParallelBulkStorage(BasicStorage):
+    """
+    Writes batches of documents with several workers at once, instead of one batch at a time.
+    batch_size defaults to the hub's batch size when not set.
+    """
+    batch_size = UPLOAD_BATCH_SIZE
+    num_workers = UPLOAD_WORKERS
+
+    def process(self, doc_d, batch_size, max_batch_num=None):
+        self.logger.info("Uploading to the DB with %s workers...", self.num_workers)
+        docs = (doc for doc in doc_d if self.check_doc_func(doc))
+        total = parallelBulkWrite(docs, lambda batch: self.temp_collection.insert_many(batch, ordered=False),
+                                  batch_size=self.batch_size or batch_size, num_workers=self.num_workers, max_batch_num=max_batch_num)
+        self.logger.info("Done with %s docs", total)
+        return total
+
+
+def merge_mapping(mapping, extra):
+    for key, value in extra.items():
+        if isinstance(value, dict) and isinstance(mapping.get(key), dict):
+            merge_mapping(mapping[key], value)
+        else:
+            mapping[key] = value
+    return mapping
 
 
 class ClinicalTrialUploader(biothings.hub.dataload.uploader.BaseSourceUploader):
@@ -25,11 +84,44 @@ class ClinicalTrialUploader(biothings.hub.dataload.uploader.BaseSourceUploader):
          "url": "https://clinicaltrials.gov/ct2/results?cond=COVID-19"
     }}
     idconverter = None
+    storage_class = ParallelBulkStorage if PARALLEL_UPLOAD else BasicStorage
 
     def load_data(self, data_folder):
+        shard_dir = None
+        summary_file = None
+        vocab_file = None
         if data_folder:
             self.logger.info("Load data from directory: '%s'", data_folder)
-        return parser_func()
+            # a sharded harvest has already been run into this release's folder, so only merge it
+            if os.path.exists(os.path.join(data_folder, SHARD_PLAN_FILE)):
+                shard_dir = data_folder
+            summary_file = os.path.join(data_folder, SUMMARY_FILE)
+            vocab_file = os.path.join(data_folder, VOCAB_FILE)
+        return parser_func(shard_dir, summary_file, vocab_file)
+
+    def post_update_data(self, steps, force, batch_size, job_manager, **kwargs):
+        # load_data wrote the summary next to the release; publish it as a single doc (_id "clinical_trials_summary"),
+        # so the dashboard counts are one lookup instead of aggregations over the whole index
+        summary_file = os.path.join(self.data_folder, SUMMARY_FILE)
+        if os.path.exists(summary_file):
+            with open(summary_file) as f:
+                summary = json.load(f)
+            self.db[SUMMARY_COLLECTION].replace_one({"_id": summary["_id"]}, summary, upsert=True)
+            self.logger.info("Published release summary to '%s'", SUMMARY_COLLECTION)
+        # vocabulary as one doc per term ID, so "all trials for condition X" is a lookup on the term's ID
+        vocab_file = os.path.join(self.data_folder, VOCAB_FILE)
+        if os.path.exists(vocab_file):
+            with open(vocab_file) as f:
+                vocab = json.load(f)
+            terms = {}
+            for facet in ["conditions", "keywords"]:
+                for term_id, term in vocab[facet]["terms"].items():
+                    terms.setdefault(term_id, {"_id": term_id, "name": term, "conditions": [], "keywords": []})
+                    terms[term_id][facet] = vocab[facet]["index"].get(term_id, [])
+            self.db[VOCAB_COLLECTION].drop()
+            if terms:
+                self.db[VOCAB_COLLECTION].insert_many(list(terms.values()))
+            self.logger.info("Published %s vocabulary terms to '%s'", len(terms), VOCAB_COLLECTION)
 
     @classmethod
     def get_mapping(klass):
@@ -37,4 +129,4 @@ class ClinicalTrialUploader(biothings.hub.dataload.uploader.BaseSourceUploader):
         if(r.status_code == 200):
             mapping = r.json()
             mapping_dict = { key: mapping[key] for key in MAP_VARS }
-            return mapping_dict
+            return merge_mapping(mapping_dict, LOCAL_MAPPING)